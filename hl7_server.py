@@ -5,13 +5,24 @@ Designed for single-client production environment
 """
 
 import socket
-import threading
+import selectors
 import logging
 import datetime
+import heapq
 import os
-import hl7
 from pathlib import Path
 
+# Timestamp formats used on every message, kept in module scope
+_FILENAME_TS_FMT = '%Y%m%d_%H%M%S'
+_ACK_TS_FMT = '%Y%m%d%H%M%S'
+
+class _ClientState:
+    """Per-connection framing state for the event loop"""
+    def __init__(self, address):
+        self.address = address
+        self.buffer = bytearray()
+        self.scan_from = 0
+
 class HL7Server:
     def __init__(self, host='0.0.0.0', port=2575, message_dir='hl7_messages', max_files=1000):
         self.host = host
@@ -20,8 +31,8 @@ class HL7Server:
         self.max_files = max_files
         self.running = False
         self.server_socket = None
-        self.file_lock = threading.Lock()  # Thread-safe file operations
-        
+        self.selector = None
+
         # Create message directory if it doesn't exist
         self.message_dir.mkdir(exist_ok=True)
         
@@ -36,159 +47,197 @@ class HL7Server:
         )
         self.logger = logging.getLogger(__name__)
         
-        # Log initial file count
-        initial_count = self.count_message_files()
-        self.logger.info(f"Message directory initialized with {initial_count} existing files (max: {self.max_files})")
-        
-        # Clean up if we're over the limit (batch cleanup)
-        if initial_count > self.max_files:
-            self.logger.info(f"Initial cleanup required: {initial_count} files exceed limit of {self.max_files}")
-            self.cleanup_old_files()
-    
-    def count_message_files(self):
-        """Count HL7 message files in directory"""
+        # One startup scan seeds the cached file count and the mtime heap
+        # (os.scandir returns stat info without a second syscall per file);
+        # both are maintained incrementally so the save and cleanup paths
+        # never rescan the directory
+        self._mtime_heap = []
         try:
-            return len([f for f in self.message_dir.glob('*.hl7')])
+            for entry in os.scandir(self.message_dir):
+                if entry.name.endswith('.hl7') and entry.is_file():
+                    self._mtime_heap.append((entry.stat().st_mtime, Path(entry.path)))
         except Exception:
-            return 0
+            pass
+        heapq.heapify(self._mtime_heap)
+        self._file_count = len(self._mtime_heap)
+
+        # Preformatted file header so each message is saved with one write
+        self._header_template = (
+            "# Received: {received}\n"
+            "# From: {host}:{port}\n"
+            "# Control ID: {control_id}\n"
+            "# Message Type: {msg_type}\n"
+            "#" + "=" * 50 + "\n"
+        )
+
+        # Preformatted bytes ACK template: only four fields vary per
+        # response, so %-format them in without a unicode round trip
+        self._ack_template = (b"MSH|^~\\&|HL7_SERVER||%b|%b|%b||ACK|%b_ACK|P|2.3.1\r"
+                              b"MSA|AA|%b|Message accepted\r\x1c")
+        self.logger.info(f"Message directory initialized with {self._file_count} existing files (max: {self.max_files})")
+
+        # Clean up if we're over the limit (batch cleanup)
+        if self._file_count > self.max_files:
+            self.logger.info(f"Initial cleanup required: {self._file_count} files exceed limit of {self.max_files}")
+            self.cleanup_old_files()
     
     def cleanup_old_files(self):
         """Remove approximately half of the files when limit is reached"""
         try:
-            # Get all .hl7 files with their modification times
-            files = []
-            for file_path in self.message_dir.glob('*.hl7'):
-                try:
-                    mtime = file_path.stat().st_mtime
-                    files.append((mtime, file_path))
-                except Exception:
-                    continue
-            
-            # Sort by modification time (oldest first)
-            files.sort(key=lambda x: x[0])
-            
-            # Calculate how many files to remove (approximately half)
-            files_to_remove = len(files) // 2
-            
+            # Pop the oldest entries off the cached mtime heap instead of
+            # globbing, stat-ing and sorting the whole directory
+            files_to_remove = len(self._mtime_heap) // 2
+
             if files_to_remove > 0:
                 removed_count = 0
-                for _, file_path in files[:files_to_remove]:
+                for _ in range(files_to_remove):
+                    _, file_path = heapq.heappop(self._mtime_heap)
                     try:
                         file_path.unlink()
                         removed_count += 1
                     except Exception as e:
                         self.logger.warning(f"Could not remove old file {file_path.name}: {e}")
-                
+
                 if removed_count > 0:
-                    remaining_files = len(files) - removed_count
-                    self.logger.info(f"Batch cleanup: removed {removed_count} oldest files, {remaining_files} files remaining")
-                    
+                    self._file_count -= removed_count
+                    self.logger.info(f"Batch cleanup: removed {removed_count} oldest files, {self._file_count} files remaining")
+
         except Exception as e:
             self.logger.error(f"Error during file cleanup: {e}")
         
     def start(self):
-        """Start the HL7 server"""
+        """Start the HL7 server (single-threaded selectors event loop)"""
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            # Set socket timeout to make it responsive to interrupts
-            self.server_socket.settimeout(1.0)
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(5)
-            
+            self.server_socket.setblocking(False)
+
+            # One event loop services the listener and every client; HL7
+            # devices are mostly idle, so one thread and one epoll set beat
+            # a thread (stack + GIL contention) per connection
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.server_socket, selectors.EVENT_READ, None)
+
+            # Shared receive block (64KB keeps the syscall count low for
+            # large waveform messages)
+            recv_view = memoryview(bytearray(65536))
+
             self.running = True
             self.logger.info(f"HL7 Server started on {self.host}:{self.port}")
             self.logger.info(f"Messages will be saved to: {self.message_dir.absolute()}")
             self.logger.info("Press Ctrl+C to stop the server")
-            
+
             while self.running:
-                try:
-                    client_socket, client_address = self.server_socket.accept()
-                    self.logger.info(f"Connection from {client_address}")
-                    
-                    # Handle each client in a separate thread
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, client_address)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
-                    
-                except socket.timeout:
-                    # Timeout is normal, just check if we should continue
-                    continue
-                except socket.error as e:
-                    if self.running:
-                        self.logger.error(f"Socket error: {e}")
-                        
+                # 1s timeout keeps the loop responsive to interrupts
+                for key, _ in self.selector.select(1.0):
+                    if key.data is None:
+                        self.accept_client()
+                    else:
+                        self.service_client(key.fileobj, key.data, recv_view)
+
         except Exception as e:
             self.logger.error(f"Failed to start server: {e}")
         finally:
             self.stop()
-    
+
     def stop(self):
         """Stop the HL7 server"""
         self.running = False
+        if self.selector:
+            self.selector.close()
+            self.selector = None
         if self.server_socket:
             self.server_socket.close()
         self.logger.info("HL7 Server stopped")
-    
-    def handle_client(self, client_socket, client_address):
-        """Handle individual client connection"""
+
+    def accept_client(self):
+        """Accept a new connection and register it with the event loop"""
         try:
-            buffer = ""
-            
-            while self.running:
-                # Receive data
-                data = client_socket.recv(4096).decode('utf-8', errors='ignore')
-                if not data:
-                    break
-                    
-                buffer += data
-                
-                # Process complete HL7 messages
-                while '\x1c' in buffer or '\r' in buffer:  # HL7 end markers
-                    # Find message boundaries
-                    end_pos = buffer.find('\x1c')  # File separator
-                    if end_pos == -1:
-                        end_pos = buffer.find('\r')  # Carriage return
-                    
-                    if end_pos == -1:
-                        break
-                        
-                    # Extract complete message
-                    message = buffer[:end_pos].strip()
-                    buffer = buffer[end_pos + 1:]
-                    
-                    if message:
-                        self.process_message(message, client_socket, client_address)
-                        
+            client_socket, client_address = self.server_socket.accept()
+        except socket.error as e:
+            if self.running:
+                self.logger.error(f"Socket error: {e}")
+            return
+
+        client_socket.setblocking(False)
+        self.logger.info(f"Connection from {client_address}")
+        self.selector.register(client_socket, selectors.EVENT_READ,
+                               _ClientState(client_address))
+
+    def close_client(self, client_socket, state):
+        """Unregister and close a client connection"""
+        try:
+            self.selector.unregister(client_socket)
+        except Exception:
+            pass
+        client_socket.close()
+        self.logger.info(f"Connection closed for {state.address}")
+
+    def service_client(self, client_socket, state, recv_view):
+        """Read available data from a client and process complete messages"""
+        try:
+            received = client_socket.recv_into(recv_view)
+        except BlockingIOError:
+            return
         except Exception as e:
-            self.logger.error(f"Error handling client {client_address}: {e}")
-        finally:
-            client_socket.close()
-            self.logger.info(f"Connection closed for {client_address}")
+            self.logger.error(f"Error handling client {state.address}: {e}")
+            self.close_client(client_socket, state)
+            return
+
+        if not received:
+            self.close_client(client_socket, state)
+            return
+
+        # Byte-level framing buffer per connection; scan_from remembers how
+        # far we have already searched for an end marker so only the newly
+        # arrived bytes are scanned
+        buffer = state.buffer
+        buffer += recv_view[:received]
+
+        # Process complete HL7 messages
+        while True:
+            # Find the next message boundary: prefer the \x1c file separator
+            # (the real message terminator) and only fall back to \r when no
+            # \x1c is buffered, so CR-separated segments inside one message
+            # are not split apart
+            end_pos = buffer.find(b'\x1c', state.scan_from)
+            if end_pos == -1:
+                end_pos = buffer.find(b'\r', state.scan_from)
+            if end_pos == -1:
+                state.scan_from = len(buffer)
+                break
+
+            # Extract complete message
+            message = bytes(buffer[:end_pos]).strip()
+            del buffer[:end_pos + 1]
+            state.scan_from = 0
+
+            if message:
+                self.process_message(message, client_socket, state.address)
     
-    def process_message(self, message_text, client_socket, client_address):
-        """Process received HL7 message"""
+    def process_message(self, message_bytes, client_socket, client_address):
+        """Process received HL7 message (raw bytes)"""
         try:
-            # Parse HL7 message
-            h = hl7.parse(message_text.replace('\n', '\r'))
-            
-            # Extract key information
-            msh = h.segment('MSH')
-            msg_control_id = str(msh[10]) if len(msh) > 10 else "UNKNOWN"
-            msg_type = str(msh[9]) if len(msh) > 9 else "UNKNOWN"
-            sending_app = str(msh[3]) if len(msh) > 3 else "UNKNOWN"
-            
+            # Only a few MSH fields are needed for logging and the ACK, so
+            # split off the first segment and decode just that slice; the
+            # message body stays bytes all the way to disk
+            first_segment = message_bytes.split(b'\r', 1)[0].split(b'\n', 1)[0]
+            msh = first_segment.decode('utf-8', errors='ignore').split('|', 11)
+            if msh[0] != 'MSH':
+                raise ValueError("Message does not start with MSH segment")
+            msg_control_id = msh[9] if len(msh) > 9 else "UNKNOWN"
+            msg_type = msh[8] if len(msh) > 8 else "UNKNOWN"
+            sending_app = msh[2] if len(msh) > 2 else "UNKNOWN"
+
             self.logger.info(f"Received {msg_type} message (ID: {msg_control_id}) from {sending_app}")
-            
+
             # Save message to file
-            self.save_message(message_text, msg_control_id, msg_type, client_address)
-            
-            # Send ACK response
-            ack_message = self.create_ack(msh)
-            client_socket.send(ack_message.encode('utf-8'))
+            self.save_message(message_bytes, msg_control_id, msg_type, client_address)
+
+            # Send ACK response (sendall guarantees the full write)
+            client_socket.sendall(self.create_ack(msh))
             
             self.logger.info(f"ACK sent for message {msg_control_id}")
             
@@ -197,57 +246,59 @@ class HL7Server:
             # Send NAK (negative acknowledgment)
             try:
                 nak_message = self.create_nak("UNKNOWN", str(e))
-                client_socket.send(nak_message.encode('utf-8'))
+                client_socket.sendall(nak_message.encode('utf-8'))
             except:
                 pass
     
-    def save_message(self, message_text, control_id, msg_type, client_address):
-        """Save HL7 message to file with batch cleanup when needed"""
-        with self.file_lock:  # Thread-safe file operations
-            try:
-                # Check if we need to clean up old files first
-                current_count = self.count_message_files()
-                if current_count >= self.max_files:
-                    self.logger.info(f"File limit reached ({current_count}/{self.max_files}), performing batch cleanup...")
-                    self.cleanup_old_files()
-                
-                timestamp = datetime.datetime.now()
-                
-                # Create filename with timestamp and control ID
-                filename = f"{timestamp.strftime('%Y%m%d_%H%M%S')}_{control_id}_{msg_type.replace('^', '_')}.hl7"
-                filepath = self.message_dir / filename
-                
-                # Write message to file
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    f.write(f"# Received: {timestamp.isoformat()}\n")
-                    f.write(f"# From: {client_address[0]}:{client_address[1]}\n")
-                    f.write(f"# Control ID: {control_id}\n")
-                    f.write(f"# Message Type: {msg_type}\n")
-                    f.write("#" + "="*50 + "\n")
-                    f.write(message_text)
-                    f.write("\n")
-                
-                # Log save with current file count
-                final_count = self.count_message_files()
-                self.logger.info(f"Message saved to {filename} ({final_count}/{self.max_files} files)")
-                
-            except Exception as e:
-                self.logger.error(f"Failed to save message: {e}")
+    def save_message(self, message_bytes, control_id, msg_type, client_address):
+        """Save HL7 message bytes to file with batch cleanup when needed"""
+        try:
+            # Check if we need to clean up old files first
+            # (cached count avoids a directory scan per message)
+            if self._file_count >= self.max_files:
+                self.logger.info(f"File limit reached ({self._file_count}/{self.max_files}), performing batch cleanup...")
+                self.cleanup_old_files()
+
+            timestamp = datetime.datetime.now()
+
+            # Create filename with timestamp and control ID
+            filename = f"{timestamp.strftime(_FILENAME_TS_FMT)}_{control_id}_{msg_type.replace('^', '_')}.hl7"
+            filepath = self.message_dir / filename
+
+            # Build header + message in one payload and write it at once;
+            # the message body is appended as-is without a decode/encode
+            # round trip
+            header = self._header_template.format(
+                received=timestamp.isoformat(),
+                host=client_address[0],
+                port=client_address[1],
+                control_id=control_id,
+                msg_type=msg_type
+            )
+            filepath.write_bytes(header.encode('utf-8') + message_bytes + b"\n")
+
+            # Track the new file for future cleanups and log the count
+            heapq.heappush(self._mtime_heap, (timestamp.timestamp(), filepath))
+            self._file_count += 1
+            self.logger.info(f"Message saved to {filename} ({self._file_count}/{self.max_files} files)")
+
+        except Exception as e:
+            self.logger.error(f"Failed to save message: {e}")
     
-    def create_ack(self, original_msh):
-        """Create ACK (acknowledgment) message"""
-        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-        control_id = str(original_msh[10]) if len(original_msh) > 10 else "UNKNOWN"
-        
-        ack = f"MSH|^~\\&|HL7_SERVER||{original_msh[3]}|{original_msh[4]}|{timestamp}||ACK|{control_id}_ACK|P|2.3.1\r"
-        ack += f"MSA|AA|{control_id}|Message accepted\r"
-        
-        return ack + '\x1c'  # Add end-of-message marker
+    def create_ack(self, msh_fields):
+        """Create ACK (acknowledgment) bytes from the split MSH fields"""
+        timestamp = datetime.datetime.now().strftime(_ACK_TS_FMT).encode()
+        control_id = (msh_fields[9] if len(msh_fields) > 9 else "UNKNOWN").encode()
+        sending_app = (msh_fields[2] if len(msh_fields) > 2 else "").encode()
+        sending_facility = (msh_fields[3] if len(msh_fields) > 3 else "").encode()
+
+        return self._ack_template % (sending_app, sending_facility, timestamp,
+                                     control_id, control_id)
     
     def create_nak(self, control_id, error_msg):
         """Create NAK (negative acknowledgment) message"""
-        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-        
+        timestamp = datetime.datetime.now().strftime(_ACK_TS_FMT)
+
         nak = f"MSH|^~\\&|HL7_SERVER||||{timestamp}||ACK|{control_id}_NAK|P|2.3.1\r"
         nak += f"MSA|AE|{control_id}|{error_msg[:100]}\r"  # Limit error message length
         
@@ -4,31 +4,24 @@ Simple HL7 Splitter - Split long HL7 ECG file into 10-second chunks
 """
 
 import os
+import re
+
+# Every HL7 message starts with an MSH segment, so splitting on that
+# boundary frames messages in one C-level pass over the raw bytes
+MSH_BOUNDARY_RE = re.compile(rb'(?m)(?=^MSH\|)')
 
 def split_hl7_to_10_seconds(input_file):
     """Split HL7 file into 10-second chunks"""
-    
+
     print(f"📖 Reading: {input_file}")
-    
-    with open(input_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
-    # Group lines by complete messages (MSH to end of ECG data)
-    messages = []
-    current_message = []
-    
-    for line in lines:
-        current_message.append(line)
-        
-        # End of ECG waveform message (after all OBX segments)
-        if line.startswith('OBX') and 'SpO2' in line:
-            messages.append(current_message)
-            current_message = []
-    
-    # Add any remaining message
-    if current_message:
-        messages.append(current_message)
-    
+
+    with open(input_file, 'rb') as f:
+        data = f.read()
+
+    # Split into complete messages at MSH boundaries instead of walking
+    # the file line by line (drop the empty piece before the first MSH)
+    messages = [message for message in MSH_BOUNDARY_RE.split(data) if message]
+
     print(f"📊 Found {len(messages)} ECG messages")
     
     # Create output directory
@@ -50,10 +43,10 @@ def split_hl7_to_10_seconds(input_file):
         chunk_number = i // chunk_size + 1
         output_file = os.path.join(output_dir, f"{base_name}_10sec_chunk_{chunk_number:03d}.hl7")
         
-        # Write chunk to file
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for message in chunk_messages:
-                f.writelines(message)
+        # Write the whole chunk with a single syscall
+        chunk_bytes = b''.join(chunk_messages)
+        with open(output_file, 'wb') as f:
+            f.write(chunk_bytes)
         
         duration = len(chunk_messages)
         print(f"✅ Created: {os.path.basename(output_file)} ({duration} seconds)")